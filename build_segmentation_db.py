@@ -0,0 +1,51 @@
+"""
+Build segmentation.db from segmentation_results.json.
+
+Each paper's parsed blocks are stored as a single msgpack blob keyed by paper,
+so the visualizer can fetch one paper with an indexed lookup instead of
+loading every paper into memory at startup. The PDF page count is stored
+alongside so the app never has to parse a PDF just to count its pages.
+
+Usage:
+    python build_segmentation_db.py [segmentation_results.json] [segmentation.db]
+"""
+import sys
+import json
+import sqlite3
+
+import fitz
+import msgpack
+
+
+def get_page_count(paper, papers_dir="papers"):
+    try:
+        with fitz.open(f"{papers_dir}/{paper}.pdf") as doc:
+            return doc.page_count
+    except Exception:
+        return None
+
+
+def build_segmentation_db(json_path="segmentation_results.json", db_path="segmentation.db"):
+    with open(json_path, 'r') as f:
+        segmentation_results = json.load(f)
+
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.execute("DROP TABLE IF EXISTS segmentation")
+        conn.execute(
+            "CREATE TABLE segmentation (paper TEXT PRIMARY KEY, blocks BLOB NOT NULL, page_count INTEGER)"
+        )
+        conn.executemany(
+            "INSERT INTO segmentation (paper, blocks, page_count) VALUES (?, ?, ?)",
+            (
+                (paper, msgpack.packb(blocks), get_page_count(paper))
+                for paper, blocks in segmentation_results.items()
+            )
+        )
+    conn.close()
+    return len(segmentation_results)
+
+
+if __name__ == "__main__":
+    n_papers = build_segmentation_db(*sys.argv[1:3])
+    print(f"Wrote {n_papers} papers")
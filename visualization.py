@@ -1,34 +1,108 @@
-import re
 import os
-import json
-import base64
-from io import BytesIO
-from PIL import Image
+import logging
+import sqlite3
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
+import msgpack
+import simdjson
 import dash
 from dash import dcc, html, Input, Output, State, ALL, callback_context
 import dash_bootstrap_components as dbc
+import plotly.io as pio
 import fitz  # PyMuPDF for reading PDF pages
+from flask import abort, send_file
+
+logger = logging.getLogger(__name__)
 
 # =============================================================================
 # Load CSV data for testing the parsing & compilation
 # segmentation_results.csv must have columns: paper, parsed_content (JSON string)
 # columns_mapping.csv must have columns: paper, mapping (JSON string)
-with open('segmentation_results.json', 'r') as f:
-    segmentation_results = json.load(f)
-with open('columns_mapping.json', 'r') as f:
-    columns_mapping = json.load(f)
+# Parsed blocks live in segmentation.db (built from segmentation_results.json by
+# build_segmentation_db.py), one msgpack blob per paper, so only the selected
+# paper is ever read from disk.
+# The mapping is parsed lazily with simdjson: only the selected paper's mapping is
+# materialized, and the parser owns the document so it is kept alive.
+# Opened read-only so a missing database is reported instead of created empty.
+_SEGMENTATION_DB_MISSING = "segmentation.db {}; build it with `python build_segmentation_db.py`"
+try:
+    _segmentation_db = sqlite3.connect(
+        'file:segmentation.db?mode=ro', uri=True, check_same_thread=False
+    )
+except sqlite3.OperationalError as e:
+    raise RuntimeError(_SEGMENTATION_DB_MISSING.format("could not be opened")) from e
+_mapping_parser = simdjson.Parser()
+columns_mapping = _mapping_parser.load('columns_mapping.json')
 
 port = int(os.environ.get("PORT", 8050))
 
-available_papers = list(segmentation_results.keys())
+# Page counts are recorded when the database is built; NULL if the PDF was missing then.
+# Databases built before page counts were added lack the column, in which case every
+# count is NULL and get_pdf_page_count falls back to PyMuPDF.
+_segmentation_columns = {row[1] for row in _segmentation_db.execute("PRAGMA table_info(segmentation)")}
+if not _segmentation_columns:
+    raise RuntimeError(_SEGMENTATION_DB_MISSING.format("has no segmentation table"))
+if "page_count" in _segmentation_columns:
+    _page_counts = dict(
+        _segmentation_db.execute("SELECT paper, page_count FROM segmentation ORDER BY rowid")
+    )
+else:
+    logger.warning("segmentation.db has no page counts; rebuild it with build_segmentation_db.py")
+    _page_counts = dict(
+        _segmentation_db.execute("SELECT paper, NULL FROM segmentation ORDER BY rowid")
+    )
+available_papers = list(_page_counts)
+
+def load_segmentation_blocks(paper):
+    row = _segmentation_db.execute(
+        "SELECT blocks FROM segmentation WHERE paper = ?", (paper,)
+    ).fetchone()
+    return msgpack.unpackb(row[0]) if row else []
 
 # =============================================================================
 # Helper: compile parsed blocks into structured dict
+# Block types that become resources, mapped to their resource content type.
+_RESOURCE_CONTENT_TYPES = {"Picture": "image", "Table": "table"}
+
+# Format of the block references used for section/subsection blocks and link labels.
+BLOCK_LINK_FORMAT = "[block:{}]"
+
+# Role of each block type in the compiled structure; unlisted types are text.
+_ROLE_TEXT, _ROLE_HEADER, _ROLE_RESOURCE, _ROLE_CAPTION = range(4)
+_BLOCK_ROLES = {
+    "Section header": _ROLE_HEADER,
+    "Picture": _ROLE_RESOURCE,
+    "Table": _ROLE_RESOURCE,
+    "Caption": _ROLE_CAPTION,
+}
+
+@dataclass(slots=True)
+class ContentEntry:
+    section: str
+    section_block: str
+    section_block_idx: int | None  # block index of section_block, None if no header
+    subsection: str
+    subsection_block: str
+    subsection_block_idx: int | None  # block index of subsection_block, None if no header
+    text: list  # segments, see compile_parsed_content
+
+@dataclass(slots=True)
+class ResourceEntry:
+    reference: str
+    content: str  # for tables: markdown-formatted table; for pictures: later replace with base64 data if needed.
+    content_type: str
+    description: list  # segments, filled in if a Caption is found
+    content_block: int  # zero-indexed block number
+    description_block: int | None
+
 def compile_parsed_content(
         parsed_content, 
         section_headers_mapping, 
-        block_link_format="[block:{}]"
+        block_link_format=BLOCK_LINK_FORMAT
 ):
     """
     Compile parsed blocks into a structured output with 'content' and 'resources'.
@@ -37,13 +111,14 @@ def compile_parsed_content(
       parsed_content (list[dict]): List of blocks from the PDF parser.
       section_headers_mapping (dict): Mapping from a Section header's text to standardized section name,
                                       or "none" if it should be treated as a subsection marker.
-      block_link_format (str): Format string for block link references, e.g. "[block:{}]". 
+      block_link_format (str): Format string for section/subsection block references, e.g. "[block:{}]". 
       
     Returns:
       dict: structured output containing:
-            - "content": list of dicts with keys: "section", "section_block", "subsection", "subsection_block", "text"
-            - "resources": list of dicts for resources with keys: "reference", "content", "content_type",
-                           "description", "content_block", "description_block"
+            - "content": list of ContentEntry
+            - "resources": list of ResourceEntry
+            ContentEntry.text and ResourceEntry.description are lists of segments: ("text", str) for literal text and
+            ("link", block_idx) for a link to a block, each block's text being wrapped in links to it.
     """
     # Initialize output lists
     content_sections = []
@@ -52,41 +127,49 @@ def compile_parsed_content(
     # Default current section and subsection values (for content before first standard header)
     current_section = "section_1"
     current_section_block = ""
+    current_section_block_idx = None
     current_subsection = "subsection_1"
     current_subsection_block = ""
-    current_text_buffer = []  # to accumulate text (with block links) that belongs to the current (sub)section
+    current_subsection_block_idx = None
+    current_text_buffer = []  # to accumulate (block_idx, text) pairs that belong to the current (sub)section
 
-    # Counters for resource references (separate from block numbering)
-    image_counter = 1
-    table_counter = 1
+    # Counters for resource references, per content type (separate from block numbering)
+    resource_counters = dict.fromkeys(_RESOURCE_CONTENT_TYPES.values(), 1)
     
     # Keep track of the most recent resource (Picture/Table) for Caption assignment.
     last_resource = None
 
     def flush_current_text():
         """Flush the current text buffer into a content entry if any text was accumulated."""
-        nonlocal current_text_buffer, current_section, current_section_block, current_subsection, current_subsection_block, content_sections
+        nonlocal current_text_buffer, current_section, current_section_block, current_section_block_idx, current_subsection, current_subsection_block, current_subsection_block_idx, content_sections
         if current_text_buffer:
-            joined_text = " ".join(current_text_buffer)
-            content_sections.append({
-                "section": current_section,
-                "section_block": current_section_block,
-                "subsection": current_subsection,
-                "subsection_block": current_subsection_block,
-                "text": joined_text
-            })
+            # Wrap each text in links to its block, separating blocks with a space.
+            segments = []
+            for block_idx, text in current_text_buffer:
+                if segments:
+                    segments.append(("text", " "))
+                segments += (("link", block_idx), ("text", text), ("link", block_idx))
+            content_sections.append(ContentEntry(
+                section=current_section,
+                section_block=current_section_block,
+                section_block_idx=current_section_block_idx,
+                subsection=current_subsection,
+                subsection_block=current_subsection_block,
+                subsection_block_idx=current_subsection_block_idx,
+                text=segments
+            ))
             current_text_buffer.clear()
 
+    # Classify every block by role in a single pass.
+    block_roles = [_BLOCK_ROLES.get(block["type"], _ROLE_TEXT) for block in parsed_content]
+
     # Process each block (zero-indexed)
     for idx, block in enumerate(parsed_content):
-        # Create the block reference using the provided format string
-        block_ref = block_link_format.format(idx)
-        block_type = block.get("type", "")
-        raw_text = block.get("text") or ""
-        block_text = raw_text.strip()
+        role = block_roles[idx]
+        block_text = (block.get("text") or "").strip()
 
         # --- Process Section header blocks ---
-        if block_type == "Section header":
+        if role == _ROLE_HEADER:
             # Look up the header mapping (you might want to normalize block_text first)
             mapped = section_headers_mapping.get(block_text, None)
             if mapped and mapped.lower() != "none":
@@ -94,71 +177,71 @@ def compile_parsed_content(
                 flush_current_text()
                 # Update current section (in lower case) and record its block reference.
                 current_section = mapped.lower()
-                current_section_block = block_ref
+                current_section_block = block_link_format.format(idx)
+                current_section_block_idx = idx
                 # Reset subsection values to defaults.
                 current_subsection = "subsection_1"
                 current_subsection_block = ""
+                current_subsection_block_idx = None
             else:
                 # Mapping returns "none" (or mapping not found) so treat as a subsection marker.
                 flush_current_text()
                 current_subsection = block_text  # Use the header text as the subsection title.
-                current_subsection_block = block_ref
+                current_subsection_block = block_link_format.format(idx)
+                current_subsection_block_idx = idx
             # Do not add the header's text to the text buffer.
         
         # --- Process resource blocks (Picture and Table) ---
-        elif block_type in ("Picture", "Table"):
-            if block_type == "Picture":
-                resource_ref = f"[image:{image_counter}]"
-                content_type = "image"
-                image_counter += 1
-            else:  # Table
-                resource_ref = f"[table:{table_counter}]"
-                content_type = "table"
-                table_counter += 1
+        elif role == _ROLE_RESOURCE:
+            content_type = _RESOURCE_CONTENT_TYPES[block["type"]]
+            resource_ref = f"[{content_type}:{resource_counters[content_type]}]"
+            resource_counters[content_type] += 1
 
             # Create the resource entry.
-            resource_entry = {
-                "reference": resource_ref,
-                "content": block_text,  # for tables: markdown-formatted table; for pictures: later replace with base64 data if needed.
-                "content_type": content_type,
-                "description": "",  # to be filled in if a Caption is found
-                "content_block": idx,       # zero-indexed block number
-                "description_block": None
-            }
+            resource_entry = ResourceEntry(
+                reference=resource_ref,
+                content=block_text,
+                content_type=content_type,
+                description=[],
+                content_block=idx,
+                description_block=None
+            )
             resources.append(resource_entry)
             last_resource = resource_entry
             # Insert a link for this resource in the joined text.
-            current_text_buffer.append(f"{block_ref}{resource_ref}{block_ref}")
+            current_text_buffer.append((idx, resource_ref))
         
         # --- Process Caption blocks ---
-        elif block_type == "Caption":
+        elif role == _ROLE_CAPTION:
             if last_resource is not None:
                 # If the last resource has no description assigned yet, assign this caption.
-                if not last_resource["description"]:
-                    last_resource["description"] = f"{block_ref}{block_text}{block_ref}"
-                    last_resource["description_block"] = idx
+                if not last_resource.description:
+                    last_resource.description = [("link", idx), ("text", block_text), ("link", idx)]
+                    last_resource.description_block = idx
             else:
                 # No resource to attach the caption to; treat as normal text.
                 if block_text:
-                    current_text_buffer.append(f"{block_ref}{block_text}{block_ref}")
+                    current_text_buffer.append((idx, block_text))
         
         # --- Process all other block types (Title, Text, List item, etc.) ---
         else:
             if block_text:
-                current_text_buffer.append(f"{block_ref}{block_text}{block_ref}")
+                current_text_buffer.append((idx, block_text))
     
     # Flush any remaining text after processing all blocks.
     flush_current_text()
     
     # If no content entries were created (e.g. if parsed content had only resources), add a default one.
     if not content_sections:
-        content_sections.append({
-            "section": current_section,
-            "section_block": current_section_block,
-            "subsection": current_subsection,
-            "subsection_block": current_subsection_block,
-            "text": ""
-        })
+        content_sections.append(ContentEntry(
+            section=current_section,
+            section_block=current_section_block,
+            section_block_idx=current_section_block_idx,
+            subsection=current_subsection,
+            subsection_block=current_subsection_block,
+            subsection_block_idx=current_subsection_block_idx,
+            text=[]
+        ))
     
     # Compile the final structured output.
     structured_output = {
@@ -169,133 +252,282 @@ def compile_parsed_content(
     return structured_output
 
 # =============================================================================
-# Helper: Get PDF total page count using PyMuPDF
+# Helper: Open each paper's PDF once and keep the document around.
+_DOC_CACHE = {}
+
+def open_pdf(paper):
+    doc = _DOC_CACHE.get(paper)
+    if doc is None:
+        doc = _DOC_CACHE[paper] = fitz.open(f"papers/{paper}.pdf")
+    return doc
+
+# =============================================================================
+# Helper: Pre-render PDF pages to JPEG files on disk.
+# Pages are served by a Flask route so the browser fetches (and caches) them
+# directly instead of receiving a base64 data URL through a Dash callback.
+PAGES_CACHE_DIR = os.environ.get("PAGES_CACHE_DIR", "cache/pages")
+# Pages are rendered at PAGE_DPI and scaled by the browser; the high-res toggle
+# re-renders only the pages it is used on at ZOOM_DPI.
+PAGE_DPI = 150
+ZOOM_DPI = 300
+JPEG_QUALITY = 85
+
+# Selecting a paper pre-renders its pages in a process pool, spread across cores;
+# each worker opens its own copy of the PDF. Cache misses are rendered in-process,
+# where PyMuPDF documents are shared between threads and so rasterization is serialized.
+RENDER_WORKERS = os.cpu_count() or 1
+_RENDER_LOCK = threading.Lock()
+_RENDER_POOL = ProcessPoolExecutor(max_workers=RENDER_WORKERS)
+
+def page_image_path(paper, page_num, dpi=PAGE_DPI):
+    return os.path.join(PAGES_CACHE_DIR, paper, str(dpi), f"{page_num}.jpg")
+
+def save_page_image(pix, path):
+    # PyMuPDF encodes JPEG natively, no PIL round-trip needed.
+    img_bytes = pix.tobytes("jpeg", jpg_quality=JPEG_QUALITY)
+    # Write to a temporary file first so a half-written image is never served.
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(img_bytes)
+    os.replace(tmp_path, path)
+
+def render_page_image(paper, page_num, dpi=PAGE_DPI):
+    path = page_image_path(paper, page_num, dpi)
+    if os.path.exists(path):
+        return path
+    with _RENDER_LOCK:
+        # PyMuPDF uses 0-indexed pages; adjust accordingly.
+        page = open_pdf(paper).load_page(page_num - 1)
+        pix = page.get_pixmap(dpi=dpi)
+    save_page_image(pix, path)
+    return path
+
+def _prerender_pages_worker(paper, page_nums):
+    # Runs in a worker process.
+    with fitz.open(f"papers/{paper}.pdf") as doc:
+        for page_num in page_nums:
+            path = page_image_path(paper, page_num)
+            if not os.path.exists(path):
+                save_page_image(doc.load_page(page_num - 1).get_pixmap(dpi=PAGE_DPI), path)
+
+def _log_prerender_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning("Pre-rendering pages failed: %r", future.exception())
+
+# Futures of each paper's pre-render jobs, so reselecting a paper whose pages are
+# still queued (A -> B -> A) does not submit them a second time.
+_PRERENDER_FUTURES = {}
+_PRERENDER_LOCK = threading.Lock()
+
+def prerender_pages(paper):
+    # Pre-rendering is only an optimization (the route renders cache misses), so it
+    # must never fail the paper-load callback.
+    with _PRERENDER_LOCK:
+        if any(not future.done() for future in _PRERENDER_FUTURES.get(paper, ())):
+            return
+        _PRERENDER_FUTURES[paper] = _submit_prerender(paper)
+
+def _submit_prerender(paper):
+    global _RENDER_POOL
+    futures = []
+    missing = [
+        page_num for page_num in range(1, get_pdf_page_count(paper) + 1)
+        if not os.path.exists(page_image_path(paper, page_num))
+    ]
+    # Interleave pages across workers so the first pages are ready first.
+    chunks = [missing[worker::RENDER_WORKERS] for worker in range(min(RENDER_WORKERS, len(missing)))]
+    try:
+        for chunk in chunks:
+            future = _RENDER_POOL.submit(_prerender_pages_worker, paper, chunk)
+            future.add_done_callback(_log_prerender_failure)
+            futures.append(future)
+    except BrokenProcessPool:
+        # A worker died (e.g. OOM-killed or a MuPDF crash); the pool is unusable from
+        # now on, so replace it. Pages of this paper render on demand meanwhile.
+        logger.warning("Render pool is broken, recreating it; skipping pre-rendering of %s", paper)
+        _RENDER_POOL.shutdown(wait=False)
+        _RENDER_POOL = ProcessPoolExecutor(max_workers=RENDER_WORKERS)
+    return futures
+
+# =============================================================================
+# Helper: Get PDF total page count, from the database when it was recorded there
+# and from PyMuPDF otherwise.
 def get_pdf_page_count(paper):
+    page_count = _page_counts.get(paper)
+    if page_count:
+        return page_count
     try:
-        doc = fitz.open(f"papers/{paper}.pdf")
-        return len(doc)
+        return open_pdf(paper).page_count
     except Exception:
         return 1
 
 # =============================================================================
-# Helper: Convert compiled text (with block links in the format "[block:{n}]")
+# Helper: Convert compiled text segments (("text", str) / ("link", block_idx))
 # into clickable Dash elements.
-def parse_block_links(text, block_pages):
-    parts = re.split(r'(\[block:\d+\])', text)
+_BLOCK_LINK_STYLE = {'color': 'blue', 'cursor': 'pointer', 'textDecoration': 'underline'}
+
+def parse_block_links(segments, block_pages):
     children = []
-    for part in parts:
-        m = re.match(r'\[block:(\d+)\]', part)
-        if m:
-            block_idx = int(m.group(1))
+    for kind, value in segments:
+        if kind == "link":
             children.append(
                 html.Span(
-                    part,
-                    id={'type': 'block-link', 'index': block_idx},
-                    style={'color': 'blue', 'cursor': 'pointer', 'textDecoration': 'underline'}
+                    BLOCK_LINK_FORMAT.format(value),
+                    id={'type': 'block-link', 'index': value},
+                    style=_BLOCK_LINK_STYLE
                 )
             )
-        else:
-            children.append(html.Span(part))
+        elif value:
+            children.append(html.Span(value))
     return children
 
 # =============================================================================
 # Helper: Build nested accordions for the compiled structure.
-def build_nested_compiled_structure_html(compiled_structure, block_pages):
-    # Group content items by section.
-    sections_dict = {}
-    for item in compiled_structure.get("content", []):
-        section = item.get("section", "section_1")
-        sections_dict.setdefault(section, []).append(item)
+# Only the section titles are rendered up front: a section's subsections are
+# rendered by load_section the first time it is expanded, and resources by
+# load_resources the first time their item is expanded.
+def group_content_by_section(compiled_structure):
+    # Group content items by section, keeping first-occurrence order.
+    sections_dict = defaultdict(list)
+    for item in compiled_structure["content"]:
+        sections_dict[item.section].append(item)
+    return list(sections_dict.items())
 
+def build_section_items(sections):
     outer_items = []
-    for section, items in sections_dict.items():
+    for position, (section, items) in enumerate(sections):
         # Use the first occurrence's section_block for the section header.
-        section_block = items[0].get("section_block", "")
+        section_index = items[0].section_block_idx
         section_link_props = {}
-        if section_block:
-            try:
-                section_index = int(re.findall(r'\d+', str(section_block))[0])
-                section_link_props = {
-                    'id': {'type': 'block-link', 'index': section_index},
-                    'style': {'color': 'blue', 'cursor': 'pointer'}
-                }
-            except Exception:
-                section_link_props = {}
-        inner_items = []
-        for sub_item in items:
-            subsection = sub_item.get("subsection", "subsection_1")
-            subsection_block = sub_item.get("subsection_block", "")
-            text = sub_item.get("text", "")
-            subsection_link_props = {}
-            if subsection_block:
-                try:
-                    subsection_index = int(re.findall(r'\d+', str(subsection_block))[0])
-                    subsection_link_props = {
-                        'id': {'type': 'block-link', 'index': subsection_index},
-                        'style': {'color': 'blue', 'cursor': 'pointer'}
-                    }
-                except Exception:
-                    subsection_link_props = {}
-            inner_items.append(
-                dbc.AccordionItem(
-                    title=html.Span(subsection, **subsection_link_props),
-                    children=parse_block_links(text, block_pages),
-                    item_id=f"subitem-{subsection_block}"
-                )
-            )
-        inner_accordion = dbc.Accordion(inner_items, flush=True, start_collapsed=True)
+        if section_index is not None:
+            section_link_props = {
+                'id': {'type': 'block-link', 'index': section_index},
+                'style': {'color': 'blue', 'cursor': 'pointer'}
+            }
         outer_items.append(
             dbc.AccordionItem(
                 title=html.Span(section, **section_link_props),
-                children=inner_accordion,
-                item_id=f"outeritem-{section_block}"
+                children=html.Div(id={'type': 'section-body', 'index': position}),
+                item_id=f"section-{position}"
             )
         )
+    return outer_items
 
-    compiled_content_div = dbc.Accordion(outer_items, flush=True, start_collapsed=True)
-
-    # Build separate accordion for resources.
-    resource_items = []
-    for res in compiled_structure.get("resources", []):
-        resource_ref = res.get("reference", "")
-        content_val = res.get("content", "")
-        description = res.get("description", "")
-        content_block = res.get("content_block", "")
-        resource_link_props = {}
-        if content_block:
-            try:
-                if isinstance(content_block, int):
-                    block_idx = content_block
-                else:
-                    block_idx = int(content_block.strip("[block:").strip("]"))
-            except Exception:
-                block_idx = 0
-            resource_link_props = {
-                'id': {'type': 'block-link', 'index': block_idx},
+def build_subsection_accordion(items, block_pages):
+    inner_items = []
+    for sub_item in items:
+        subsection = sub_item.subsection
+        subsection_block = sub_item.subsection_block
+        subsection_index = sub_item.subsection_block_idx
+        text = sub_item.text
+        subsection_link_props = {}
+        if subsection_index is not None:
+            subsection_link_props = {
+                'id': {'type': 'block-link', 'index': subsection_index},
                 'style': {'color': 'blue', 'cursor': 'pointer'}
             }
+        inner_items.append(
+            dbc.AccordionItem(
+                title=html.Span(subsection, **subsection_link_props),
+                children=parse_block_links(text, block_pages),
+                item_id=f"subitem-{subsection_block}"
+            )
+        )
+    return dbc.Accordion(inner_items, flush=True, start_collapsed=True)
+
+def build_resource_items(resources, block_pages):
+    resource_items = []
+    for res in resources:
+        resource_ref = res.reference
+        content_val = res.content
+        description = res.description
+        content_block = res.content_block
+        # content_block is always the resource's integer block index.
+        resource_link_props = {
+            'id': {'type': 'block-link', 'index': content_block},
+            'style': {'color': 'blue', 'cursor': 'pointer'}
+        }
         resource_items.append(
             dbc.AccordionItem(
                 title=html.Span(f"Resource {resource_ref}", **resource_link_props),
                 children=[
                     html.P("Content: " + content_val),
-                    html.P("Description: " + description)
+                    html.P(["Description: ", *parse_block_links(description, block_pages)])
                 ],
                 item_id=f"resource-{content_block}"
             )
         )
-    compiled_resources_div = dbc.Accordion(resource_items, flush=True, start_collapsed=True)
+    return resource_items
+
+def build_nested_compiled_structure_html(compiled_structure, sections, block_pages):
+    compiled_content_div = dbc.Accordion(
+        build_section_items(sections),
+        id="compiled-content-accordion",
+        flush=True,
+        start_collapsed=True
+    )
+
+    # Resources are collapsed into a single item whose children are filled in by
+    # load_resources the first time it is expanded.
+    resources = compiled_structure["resources"]
+    compiled_resources_div = dbc.Accordion(
+        [dbc.AccordionItem(
+            id="resources-item",
+            title=f"Resources ({len(resources)})",
+            children=[],
+            item_id="resources"
+        )],
+        id="resources-accordion",
+        flush=True,
+        start_collapsed=True
+    )
 
     return html.Div([
         html.H4("Compiled Structure"),
         compiled_content_div,
+        dcc.Store(id="loaded-sections", data=[]),
         html.H4("Resources"),
+        dcc.Store(id="resources-loaded", data=False),
         compiled_resources_div
     ])
 
+# =============================================================================
+# Helper: Compile a paper and build its accordion once, reusing the result on
+# later selections and in the lazy-loading callbacks. Blocks and mappings are
+# static for the app's lifetime, so the paper id alone is a sufficient cache key.
+_COMPILED_PAPERS = {}
+
+def compile_paper(paper):
+    if paper not in _COMPILED_PAPERS:
+        parsed_content = load_segmentation_blocks(paper)
+        mapping = columns_mapping[paper].as_dict() if paper in columns_mapping else {}
+        compiled_structure = compile_parsed_content(parsed_content, mapping)
+
+        # Block indices are dense (0..N-1), so the block -> page mapping is a list.
+        block_pages = [block.get("page_number", 1) for block in parsed_content]
+
+        sections = group_content_by_section(compiled_structure)
+        compiled_html = build_nested_compiled_structure_html(compiled_structure, sections, block_pages)
+        _COMPILED_PAPERS[paper] = (compiled_structure, sections, block_pages, compiled_html)
+    return _COMPILED_PAPERS[paper]
+
 # =============================================================================
 # Build the Dash app layout
-app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
+# Dash serializes each callback response (component tree and Store data together)
+# with plotly's to_json_plotly. orjson cannot encode Dash components, so plotly's
+# "auto"/"orjson" engine falls back to its pure-Python cleaning pass first: a
+# load_paper response took ~44 ms median with orjson vs ~26 ms with the stdlib
+# encoder. Pin the stdlib engine so an installed orjson is never picked up.
+pio.json.config.default_engine = "json"
+
+# The compiled structure is rendered inside "compiled-structure-div", so its lazy-loading
+# components are not part of the initial layout.
+app = dash.Dash(
+    __name__,
+    external_stylesheets=[dbc.themes.BOOTSTRAP],
+    suppress_callback_exceptions=True
+)
 server = app.server
 
 app.layout = html.Div([
@@ -318,7 +550,8 @@ app.layout = html.Div([
                      }
                  ),
                  dbc.Button("Next Page >", id="next-page-btn", n_clicks=0, className="me-1"),
-                 dbc.Button("Last Page >>", id="last-page-btn", n_clicks=0)
+                 dbc.Button("Last Page >>", id="last-page-btn", n_clicks=0, className="me-1"),
+                 dbc.Button("High-res", id="zoom-btn", n_clicks=0, active=False)
              ], className="ms-3", style={'marginRight': '150px'}),
             dcc.Dropdown(
                 id="paper-dropdown",
@@ -366,37 +599,81 @@ app.layout = html.Div([
     # Hidden dcc.Store components for sharing state.
     dcc.Store(id="selected-paper"),
     dcc.Store(id="current-page", data=1),
-    dcc.Store(id="compiled-structure-store"),
-    dcc.Store(id="block-pages-store"),  # Mapping: block index (as string) → page number.
-    dcc.Store(id="total-pages", data=1)
+    dcc.Store(id="block-pages-store"),  # List: block index → page number.
+    dcc.Store(id="total-pages", data=1),
+    dcc.Store(id="zoomed", data=False)
 ])
 
 # =============================================================================
 # In the load_paper function - Fix block_pages creation:
 @app.callback(
     [Output("selected-paper", "data"),
-     Output("compiled-structure-store", "data"),
      Output("block-pages-store", "data"),
      Output("total-pages", "data"),
      Output("current-page", "data"),
      Output("compiled-structure-div", "children")],
-    Input("paper-dropdown", "value")
+    Input("paper-dropdown", "value"),
+    State("selected-paper", "data")
 )
-def load_paper(paper):
+def load_paper(paper, selected_paper):
     if paper is None:
-        return dash.no_update, dash.no_update, dash.no_update, dash.no_update, dash.no_update, ""
-    parsed_content = segmentation_results.get(paper, [])
-    mapping = columns_mapping.get(paper, {})
-    compiled_structure = compile_parsed_content(parsed_content, mapping)
-    
-    # Fix 1: Create block_pages using actual block numbers from content
-    block_pages = {}
-    for i, block in enumerate(parsed_content):
-        block_pages[i] = block.get("page_number", 1)
-    
+        # Forget the cleared paper so selecting it again reloads its structure.
+        return None, dash.no_update, dash.no_update, dash.no_update, ""
+    # Reselecting the paper that is already loaded changes nothing.
+    if paper == selected_paper:
+        return (dash.no_update,) * 5
+    # The compiled structure itself stays in the server-side cache; the lazy-loading
+    # callbacks read it from there by paper id.
+    _, _, block_pages, compiled_html = compile_paper(paper)
     total_pages = get_pdf_page_count(paper)
-    compiled_html = build_nested_compiled_structure_html(compiled_structure, block_pages)
-    return paper, compiled_structure, block_pages, total_pages, 1, compiled_html
+    prerender_pages(paper)
+    return paper, block_pages, total_pages, 1, compiled_html
+
+# =============================================================================
+# Render a section's subsections the first time it is expanded.
+@app.callback(
+    [Output({'type': 'section-body', 'index': ALL}, "children"),
+     Output("loaded-sections", "data")],
+    Input("compiled-content-accordion", "active_item"),
+    [State("loaded-sections", "data"),
+     State("selected-paper", "data")],
+    prevent_initial_call=True
+)
+def load_section(active_item, loaded_sections, paper):
+    if not active_item or not paper:
+        raise dash.exceptions.PreventUpdate
+    position = int(active_item.removeprefix("section-"))
+    if position in loaded_sections:
+        raise dash.exceptions.PreventUpdate
+    # Sections come from the server-side cache rather than the browser.
+    _, sections, block_pages, _ = compile_paper(paper)
+    section_bodies = [
+        build_subsection_accordion(sections[position][1], block_pages)
+        if output["id"]["index"] == position else dash.no_update
+        for output in callback_context.outputs_list[0]
+    ]
+    return section_bodies, loaded_sections + [position]
+
+# =============================================================================
+# Render the resources the first time their accordion item is expanded.
+@app.callback(
+    [Output("resources-item", "children"),
+     Output("resources-loaded", "data")],
+    Input("resources-accordion", "active_item"),
+    [State("resources-loaded", "data"),
+     State("selected-paper", "data")],
+    prevent_initial_call=True
+)
+def load_resources(active_item, resources_loaded, paper):
+    if active_item != "resources" or resources_loaded or not paper:
+        raise dash.exceptions.PreventUpdate
+    compiled_structure, _, block_pages, _ = compile_paper(paper)
+    resources_accordion = dbc.Accordion(
+        build_resource_items(compiled_structure["resources"], block_pages),
+        flush=True,
+        start_collapsed=True
+    )
+    return resources_accordion, True
 
 # In the update_page callback - Fix index handling:
 @app.callback(
@@ -418,59 +695,62 @@ def update_page(n_first, n_prev, n_next, n_last, block_clicks,
     ctx = callback_context
     if not ctx.triggered or paper is None:
         raise dash.exceptions.PreventUpdate
-    print(f'block_pages: {block_pages}')
-    # Get the ID of the triggered component
-    triggered_id = ctx.triggered[0]['prop_id']
+    logger.debug("block_pages: %s", block_pages)
+    # Get the ID of the triggered component (a dict for block links)
+    triggered_id = ctx.triggered_id
     
     # Initialize new_page with current value
     new_page = current_page
     
     # Handle navigation buttons
-    if "first-page-btn" in triggered_id:
+    if triggered_id == "first-page-btn":
         new_page = 1
-    elif "prev-page-btn" in triggered_id:
+    elif triggered_id == "prev-page-btn":
         new_page = max(1, current_page - 1)
-    elif "next-page-btn" in triggered_id:
+    elif triggered_id == "next-page-btn":
         new_page = min(total_pages, current_page + 1)
-    elif "last-page-btn" in triggered_id:
+    elif triggered_id == "last-page-btn":
         new_page = total_pages
-    elif "block-link" in triggered_id:
-        # Fix 2: Get actual block index from component ID
-        block_index = (
-            ctx.triggered[0]['prop_id']
-            .split('"index":')[1].split("}")[0].strip()
-            .split(',')[0]
-        )
-        print(f'block_index: {block_index}')
-        # print(f'block_pages[str(block_index)]: {block_pages[str(block_index)]}')
-        new_page = block_pages.get(str(int(block_index)), current_page)
-        print(f'new_page: {new_page}')
+    elif isinstance(triggered_id, dict) and triggered_id.get("type") == "block-link":
+        # Links inserted after the paper loaded (lazily rendered accordion content)
+        # also trigger this callback, with n_clicks still None; only clicks count.
+        if not ctx.triggered[0]["value"]:
+            raise dash.exceptions.PreventUpdate
+        block_index = triggered_id["index"]
+        logger.debug("block_index: %s", block_index)
+        if 0 <= block_index < len(block_pages):
+            new_page = block_pages[block_index]
+        logger.debug("new_page: %s", new_page)
 
     page_info = f"Page {new_page} of {total_pages}"
     return new_page, page_info
 
+# =============================================================================
+# Toggle high-res rendering of the displayed page.
+@app.callback(
+    [Output("zoomed", "data"),
+     Output("zoom-btn", "active")],
+    Input("zoom-btn", "n_clicks"),
+    State("zoomed", "data"),
+    prevent_initial_call=True
+)
+def toggle_zoom(n_clicks, zoomed):
+    return not zoomed, not zoomed
+
 # =============================================================================
 # Callback 3: Render the PDF page content as an image.
 @app.callback(
     Output('page-content', 'children'),
-    [Input('current-page', 'data')],
+    [Input('current-page', 'data'),
+     Input('zoomed', 'data')],
     [State('selected-paper', 'data')]
 )
-def display_page_content(page_num, paper):
+def display_page_content(page_num, zoomed, paper):
     if page_num is not None and paper:
-        file_path = f"papers/{paper}.pdf"
-        doc = fitz.open(file_path)
-        # PyMuPDF uses 0-indexed pages; adjust accordingly.
-        page = doc.load_page(page_num - 1)
-        pix = page.get_pixmap(dpi=200)
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-        buffer = BytesIO()
-        img.save(buffer, format="PNG")
-        img_str = base64.b64encode(buffer.getvalue()).decode()
-        img_data = f"data:image/png;base64,{img_str}"
+        dpi = ZOOM_DPI if zoomed else PAGE_DPI
         return html.Div([
             html.Img(
-                src=img_data,
+                src=app.get_relative_path(f"/pages/{paper}/{dpi}/{page_num}.jpg"),
                 style={
                     'max-width': '100%',
                     'max-height': '100%',
@@ -481,6 +761,18 @@ def display_page_content(page_num, paper):
         ])
     return ""
 
+# =============================================================================
+# Route: Serve pre-rendered page images, rendering on demand on a cache miss.
+@server.route("/pages/<paper>/<int:dpi>/<int:page_num>.jpg")
+def serve_page_image(paper, dpi, page_num):
+    if (
+        paper not in available_papers
+        or dpi not in (PAGE_DPI, ZOOM_DPI)
+        or not 1 <= page_num <= get_pdf_page_count(paper)
+    ):
+        abort(404)
+    return send_file(render_page_image(paper, page_num, dpi), mimetype="image/jpeg", max_age=3600)
+
 # =============================================================================
 # Run the app
 if __name__ == "__main__":